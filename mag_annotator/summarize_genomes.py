@@ -3,12 +3,14 @@ from collections import Counter, defaultdict
 from os import path, mkdir
 import altair as alt
 import networkx as nx
+import xlsxwriter
 from itertools import tee
 import re
 import numpy as np
 from datetime import datetime
+from multiprocessing import Pool
 
-from mag_annotator.utils import get_database_locs, get_ids_from_annotation, get_ids_from_row
+from mag_annotator.utils import get_database_locs, get_ids_from_annotation, get_ids_from_row, ID_COLUMNS
 
 # TODO: add RBH information to output
 # TODO: add flag to output table and not xlsx
@@ -24,6 +26,7 @@ KO_REGEX = r'^K\d\d\d\d\d$'
 ETC_COVERAGE_COLUMNS = ['module_id', 'module_name', 'complex', 'genome', 'path_length', 'path_length_coverage',
                         'percent_coverage', 'genes', 'missing_genes', 'complex_module_name']
 TAXONOMY_LEVELS = ['d', 'p', 'c', 'o', 'f', 'g', 's']
+SUMMARY_ANNOTATION_COLUMNS = ['scaffold'] + ID_COLUMNS + ['bin_taxonomy', 'bin_completeness', 'bin_contamination']
 
 
 def get_ordered_uniques(seq):
@@ -32,93 +35,106 @@ def get_ordered_uniques(seq):
     return [x for x in seq if not (x in seen or seen_add(x))]
 
 
-def fill_genome_summary_frame(annotations, genome_summary_frame, groupby_column):
-    genome_summary_id_sets = [set([k.strip() for k in j.split(',')]) for j in genome_summary_frame['gene_id']]
-    for genome, frame in annotations.groupby(groupby_column, sort=False):
-        id_dict = get_ids_from_annotation(frame)
-        counts = list()
-        for i in genome_summary_id_sets:
-            identifier_count = 0
-            for j in i:
-                if j in id_dict:
-                    identifier_count += id_dict[j]
-            counts.append(identifier_count)
-        genome_summary_frame[genome] = counts
-    return genome_summary_frame
+def get_genome_groups(annotations, groupby_column='fasta'):
+    """Split annotations into a dict of per genome frames, kept in order of first appearance"""
+    return dict(list(annotations.groupby(groupby_column, sort=False, observed=True)))
 
 
-def fill_genome_summary_frame_gene_names(annotations, genome_summary_frame, groupby_column):
-    genome_summary_id_sets = [set([k.strip() for k in j.split(',')]) for j in genome_summary_frame['gene_id']]
-    for genome, frame in annotations.groupby(groupby_column, sort=False):
+def get_genome_ids(groups, threads=1):
+    """Count the identifiers annotated in each genome from a dict of per genome frames"""
+    if threads > 1:
+        # only send the identifier columns to the workers
+        with Pool(threads) as pool:
+            genome_ids = pool.map(get_ids_from_annotation,
+                                  [frame[[i for i in ID_COLUMNS if i in frame]] for frame in groups.values()])
+    else:
+        genome_ids = [get_ids_from_annotation(frame) for frame in groups.values()]
+    return dict(zip(groups.keys(), genome_ids))
+
+
+def fill_genome_summary_frame(annotations, genome_summary_frame, groupby_column, genome_ids=None):
+    if genome_ids is None:
+        genome_ids = get_genome_ids(get_genome_groups(annotations, groupby_column))
+    # long form of the identifiers in each row of the genome summary frame
+    summary_ids = pd.Series(genome_summary_frame['gene_id'].to_numpy()).str.split(',').explode().str.strip()
+    summary_ids = summary_ids.reset_index().drop_duplicates()
+    summary_ids.columns = ['row', 'id']
+    # identifier by genome table of counts, only for identifiers in the genome summary frame
+    summary_id_set = set(summary_ids['id'])
+    id_counts = pd.DataFrame([[genome, id_, count] for genome, ids in genome_ids.items()
+                              for id_, count in ids.items() if id_ in summary_id_set],
+                             columns=['genome', 'id', 'count'])
+    id_counts = id_counts.pivot(index='id', columns='genome', values='count').reindex(columns=list(genome_ids))
+    # sum counts over all identifiers in each row
+    counts = id_counts.reindex(summary_ids['id']).fillna(0)
+    counts = counts.groupby(summary_ids['row'].to_numpy()).sum()
+    counts = counts.reindex(range(genome_summary_frame.shape[0]), fill_value=0).astype(int)
+    counts.index = genome_summary_frame.index
+    return pd.concat([genome_summary_frame, counts], axis=1)
+
+
+def fill_genome_summary_frame_gene_names(annotations, genome_summary_frame, groupby_column, groups=None):
+    if groups is None:
+        groups = get_genome_groups(annotations, groupby_column)
+    # map each identifier to the genome summary rows it is counted in once for all genomes
+    id_row_dict = defaultdict(list)
+    for i, gene_ids in enumerate(genome_summary_frame['gene_id']):
+        for id_ in set([k.strip() for k in gene_ids.split(',')]):
+            id_row_dict[id_].append(i)
+    for genome, frame in groups.items():
         # make dict of identifiers to gene names
         id_gene_dict = defaultdict(list)
         for gene, row in frame.iterrows():
             ids = get_ids_from_row(row)
             for id_ in ids:
                 id_gene_dict[id_].append(gene)
-        # fill in genome summary_frame
-        values = list()
-        for id_set in genome_summary_id_sets:
-            this_value = list()
-            for id_ in id_set:
-                this_value += id_gene_dict[id_]
-            values.append(','.join(this_value))
-        genome_summary_frame[genome] = values
+        # fill in genome summary_frame, only visiting rows with identifiers found in this genome
+        values = [list() for _ in range(genome_summary_frame.shape[0])]
+        for id_, genes in id_gene_dict.items():
+            for i in id_row_dict.get(id_, ()):
+                values[i] += genes
+        genome_summary_frame[genome] = [','.join(value) for value in values]
     return genome_summary_frame
 
 
 def summarize_rrnas(rrnas_df, groupby_column='fasta'):
-    genome_rrna_dict = dict()
-    for genome, frame in rrnas_df.groupby(groupby_column):
-        genome_rrna_dict[genome] = Counter(frame['type'])
-    row_list = list()
-    for rna_type in RRNA_TYPES:
-        row = [rna_type, '%s ribosomal RNA gene' % rna_type.split()[0], 'rRNA', 'rRNA', '', '']
-        for genome, rrna_dict in genome_rrna_dict.items():
-            row.append(genome_rrna_dict[genome].get(rna_type, 0))
-        row_list.append(row)
-    rrna_frame = pd.DataFrame(row_list, columns=FRAME_COLUMNS + list(genome_rrna_dict.keys()))
+    rrna_frame = pd.DataFrame([[rna_type, '%s ribosomal RNA gene' % rna_type.split()[0], 'rRNA', 'rRNA', '', '']
+                               for rna_type in RRNA_TYPES], columns=FRAME_COLUMNS)
+    counts = pd.crosstab(rrnas_df['type'], rrnas_df[groupby_column]).reindex(RRNA_TYPES, fill_value=0)
+    counts.columns.name = None
+    rrna_frame = pd.concat([rrna_frame, counts.reset_index(drop=True)], axis=1)
     return rrna_frame
 
 
 def summarize_trnas(trnas_df, groupby_column='fasta'):
+    # build gene ids and descriptions for every tRNA at once
+    trna_types = trnas_df['Type'].astype(str)
+    trna_codons = trnas_df['Codon'].astype(str)
+    pseudo = trnas_df['Note'].eq('pseudo').to_numpy()
+    trnas_df = trnas_df.assign(
+        gene_id=np.where(pseudo, trna_types + ', pseudo (' + trna_codons + ')',
+                         trna_types + ' (' + trna_codons + ')'),
+        gene_description=np.where(pseudo, trna_types + ' pseudo tRNA with ' + trna_codons + ' Codon',
+                                  trna_types + ' tRNA with ' + trna_codons + ' Codon'),
+        module=trna_types + ' tRNA')
     # first build the frame
-    combos = {(line.Type, line.Codon, line.Note) for _, line in trnas_df.iterrows()}
-    frame_rows = list()
-    for combo in combos:
-        if combo[2] == 'pseudo':
-            gene_id = '%s, pseudo (%s)'
-            gene_description = '%s pseudo tRNA with %s Codon'
-        else:
-            gene_id = '%s (%s)'
-            gene_description = '%s tRNA with %s Codon'
-        gene_id = gene_id % (combo[0], combo[1])
-        gene_description = gene_description % (combo[0], combo[1])
-        module_description = '%s tRNA' % combo[0]
-        frame_rows.append([gene_id, gene_description, module_description, 'tRNA', 'tRNA', ''])
-    trna_frame = pd.DataFrame(frame_rows, columns=FRAME_COLUMNS)
-    trna_frame = trna_frame.sort_values('gene_id')
+    trna_frame = trnas_df[['gene_id', 'gene_description', 'module']].drop_duplicates('gene_id')
+    trna_frame = trna_frame.assign(sheet='tRNA', header='tRNA', subheader='')
+    trna_frame = trna_frame.sort_values('gene_id').set_index('gene_id')
     # then fill it in
-    trna_frame = trna_frame.set_index('gene_id')
-    for group, frame in trnas_df.groupby(groupby_column):
-        gene_ids = list()
-        for index, line in frame.iterrows():
-            if line.Note == 'pseudo':
-                gene_id = '%s, pseudo (%s)'
-            else:
-                gene_id = '%s (%s)'
-            gene_ids.append(gene_id % (line.Type, line.Codon))
-        trna_frame[group] = pd.Series(Counter(gene_ids))
+    counts = trnas_df.groupby([groupby_column, 'gene_id'], observed=True).size().unstack(groupby_column)
+    trna_frame = trna_frame.join(counts)
     trna_frame = trna_frame.reset_index()
     trna_frame = trna_frame.fillna(0)
     return trna_frame
 
 
 def make_genome_summary(annotations, genome_summary_frame, trna_frame=None, rrna_frame=None,
-                        groupby_column='fasta'):
+                        groupby_column='fasta', genome_ids=None):
     summary_frames = list()
     # get ko summaries
-    summary_frames.append(fill_genome_summary_frame(annotations, genome_summary_frame.copy(), groupby_column))
+    summary_frames.append(fill_genome_summary_frame(annotations, genome_summary_frame.copy(), groupby_column,
+                                                    genome_ids))
 
     # add rRNAs
     if rrna_frame is not None:
@@ -134,111 +150,122 @@ def make_genome_summary(annotations, genome_summary_frame, trna_frame=None, rrna
 
 
 def write_summarized_genomes_to_xlsx(summarized_genomes, output_file):
-    # turn all this into an xlsx
-    with pd.ExcelWriter(output_file) as writer:
-        for sheet, frame in summarized_genomes.groupby('sheet', sort=False):
-            frame = frame.sort_values(['header', 'subheader', 'module', 'gene_id'])
-            frame = frame.drop(['sheet'], axis=1)
-            frame.to_excel(writer, sheet_name=sheet, index=False)
+    # sort and drop the sheet column once, then split into sheets in their original order
+    sheet_order = summarized_genomes['sheet'].dropna().unique()
+    sorted_genomes = summarized_genomes.sort_values(['header', 'subheader', 'module', 'gene_id'])
+    sheet_frames = dict(list(sorted_genomes.drop(['sheet'], axis=1).groupby(sorted_genomes['sheet'], sort=False)))
+    # turn all this into an xlsx, rows are written in order so they can be streamed to disk
+    with xlsxwriter.Workbook(output_file, {'constant_memory': True}) as workbook:
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        for sheet in sheet_order:
+            frame = sheet_frames[sheet]
+            worksheet = workbook.add_worksheet(sheet)
+            worksheet.write_row(0, 0, list(frame.columns), header_format)
+            frame = frame.astype(object).where(frame.notna(), None)
+            for i, row in enumerate(frame.itertuples(index=False), start=1):
+                worksheet.write_row(i, 0, row)
 
 
 # TODO: add assembly stats like N50, longest contig, total assembled length etc
 def make_genome_stats(annotations, rrna_frame=None, trna_frame=None, groupby_column='fasta'):
-    rows = list()
-    columns = ['genome']
-    if 'scaffold' in annotations.columns:
-        columns.append('number of scaffolds')
-    if 'bin_taxonomy' in annotations.columns:
-        columns.append('taxonomy')
-    if 'bin_completeness' in annotations.columns:
-        columns.append('completeness score')
-    if 'bin_contamination' in annotations.columns:
-        columns.append('contamination score')
+    # get per genome values from annotations in one aggregation
+    genome_columns = {'scaffold': ('number of scaffolds', 'nunique'), 'bin_taxonomy': ('taxonomy', 'first'),
+                      'bin_completeness': ('completeness score', 'first'),
+                      'bin_contamination': ('contamination score', 'first')}
+    genome_columns = {column: name_func for column, name_func in genome_columns.items()
+                      if column in annotations.columns}
+    genome_groups = annotations.groupby(groupby_column, sort=False, observed=True)
+    genome_values = genome_groups.agg({column: func for column, (_, func) in genome_columns.items()}) \
+        if len(genome_columns) > 0 else genome_groups.size().to_frame()
+    genomes = list(genome_values.index)
+    genome_stats = pd.DataFrame({'genome': genomes})
+    for column, (name, _) in genome_columns.items():
+        genome_stats[name] = genome_values[column].to_numpy()
+    # add rRNA locations, only a single copy of an rRNA counts as having it
+    has_rrna = np.ones(len(genomes), dtype=bool)
     if rrna_frame is not None:
-        columns += RRNA_TYPES
+        rrna_groups = {genome: dict(list(frame.groupby('type', observed=True)))
+                       for genome, frame in rrna_frame.groupby('fasta', observed=True)}
+        for rrna in RRNA_TYPES:
+            rrna_values = list()
+            for i, genome in enumerate(genomes):
+                sixteens = rrna_groups.get(genome, {}).get(rrna)
+                if sixteens is None:
+                    rrna_values.append('')
+                    has_rrna[i] = False
+                elif sixteens.shape[0] == 1:
+                    rrna_values.append('%s (%s, %s)' % (sixteens['scaffold'].iloc[0], sixteens.begin.iloc[0],
+                                                        sixteens.end.iloc[0]))
+                else:
+                    rrna_values.append('%s present' % sixteens.shape[0])
+                    has_rrna[i] = False
+            genome_stats[rrna] = rrna_values
+    # add tRNA counts
     if trna_frame is not None:
-        columns.append('tRNA count')
+        trna_groups = trna_frame.groupby(groupby_column, observed=True)
+        trna_counts = trna_groups.size().to_dict()
+        trna_type_counts = trna_groups['Type'].nunique().to_dict()
+        # TODO: remove psuedo from count?
+        genome_stats['tRNA count'] = [trna_counts.get(genome, 0) for genome in genomes]
+    # get assembly quality
     if 'bin_completeness' in annotations.columns and 'bin_contamination' in annotations.columns \
        and rrna_frame is not None and trna_frame is not None:
-        columns.append('assembly quality')
-    for genome, frame in annotations.groupby(groupby_column, sort=False):
-        row = [genome]
-        if 'scaffold' in frame.columns:
-            row.append(len(set(frame['scaffold'])))
-        if 'bin_taxonomy' in frame.columns:
-            row.append(frame['bin_taxonomy'][0])
-        if 'bin_completeness' in frame.columns:
-            row.append(frame['bin_completeness'][0])
-        if 'bin_contamination' in frame.columns:
-            row.append(frame['bin_contamination'][0])
-        has_rrna = list()
-        if rrna_frame is not None:
-            genome_rrnas = rrna_frame.loc[rrna_frame.fasta == genome]
-            for rrna in RRNA_TYPES:
-                sixteens = genome_rrnas.loc[genome_rrnas.type == rrna]
-                if sixteens.shape[0] == 0:
-                    row.append('')
-                    has_rrna.append(False)
-                elif sixteens.shape[0] == 1:
-                    row.append('%s (%s, %s)' % (sixteens['scaffold'].iloc[0], sixteens.begin.iloc[0],
-                                                sixteens.end.iloc[0]))
-                    has_rrna.append(True)
-                else:
-                    row.append('%s present' % sixteens.shape[0])
-                    has_rrna.append(False)
-        if trna_frame is not None:
-            row.append(trna_frame.loc[trna_frame[groupby_column] == genome].shape[0])  # TODO: remove psuedo from count?
-        if 'assembly quality' in columns:
-            if frame['bin_completeness'][0] > 90 and frame['bin_contamination'][0] < 5 and np.all(has_rrna) and \
-               len(set(trna_frame.loc[trna_frame[groupby_column] == genome].Type)) >= 18:
-                row.append('high')
-            elif frame['bin_completeness'][0] >= 50 and frame['bin_contamination'][0] < 10:
-                row.append('med')
-            else:
-                row.append('low')
-        rows.append(row)
-    genome_stats = pd.DataFrame(rows, columns=columns)
+        completeness = genome_stats['completeness score']
+        contamination = genome_stats['contamination score']
+        has_trnas = np.array([trna_type_counts.get(genome, 0) >= 18 for genome in genomes], dtype=bool)
+        genome_stats['assembly quality'] = np.select(
+            [(completeness > 90) & (contamination < 5) & has_rrna & has_trnas,
+             (completeness >= 50) & (contamination < 10)],
+            ['high', 'med'], 'low')
     return genome_stats
 
 
+class ModuleNet:
+    """Paths of a module, each with the step it fills and the kos that can fill it"""
+    def __init__(self, module_id, module_name, num_steps, path_steps, path_kos):
+        self.module_id = module_id
+        self.module_name = module_name
+        self.num_steps = num_steps
+        self.path_steps = np.asarray(path_steps, dtype=int)
+        self.path_kos = path_kos
+        # steps that are ended by a path or lead into one, only these can be missing
+        self.end_steps = np.union1d(self.path_steps, self.path_steps[self.path_steps > 0] - 1)
+        # give each ko in the module a bit so ko sets can be stored as integer masks
+        self.ko_index = {ko: i for i, ko in enumerate(sorted(set().union(*path_kos)))}
+        self.path_masks = [sum(1 << self.ko_index[ko] for ko in kos) for kos in path_kos]
+
+
 def build_module_net(module_df):
     """Starts with a data from including a single module"""
     # build net from a set of module paths
-    num_steps = max([int(i.split(',')[0]) for i in set(module_df['path'])])
-    module_net = nx.DiGraph(num_steps=num_steps, module_id=list(module_df['module'])[0],
-                            module_name=list(module_df['module_name'])[0])
+    steps = module_df['path'].str.split(',', n=1).str[0].astype(int).rename('step')
+    path_steps = list()
+    path_kos = list()
     # go through all path/step combinations
-    for module_path, frame in module_df.groupby('path'):
-        split_path = [int(i) for i in module_path.split(',')]
-        step = split_path[0]
-        module_net.add_node(module_path, kos=set(frame['ko']))
-        # add incoming edge
-        if step != 0:
-            module_net.add_edge('end_step_%s' % (step - 1), module_path)
-        # add outgoing edge
-        module_net.add_edge(module_path, 'end_step_%s' % step)
-    return module_net
+    for (module_path, step), frame in module_df.groupby([module_df['path'], steps], sort=False):
+        path_steps.append(step)
+        path_kos.append(frozenset(frame['ko']))
+    return ModuleNet(module_df['module'].iloc[0], module_df['module_name'].iloc[0], int(steps.max()), path_steps,
+                     path_kos)
 
 
 def get_module_step_coverage(kos, module_net):
-    # prune network based on what kos were observed
-    pruned_module_net = module_net.copy()
-    module_kos_present = set()
-    for node, data in module_net.nodes.items():
-        if 'kos' in data:
-            ko_overlap = data['kos'] & kos
-            if len(ko_overlap) == 0:
-                pruned_module_net.remove_node(node)
-            else:
-                module_kos_present = module_kos_present | ko_overlap
-    # count number of missing steps
-    missing_steps = 0
-    for node, data in pruned_module_net.nodes.items():
-        if ('end_step' in node) and (pruned_module_net.in_degree(node) == 0):
-            missing_steps += 1
+    kos_mask = 0
+    for ko, i in module_net.ko_index.items():
+        if ko in kos:
+            kos_mask |= 1 << i
+    # find paths with kos that were observed
+    path_overlaps = [path_mask & kos_mask for path_mask in module_net.path_masks]
+    present = np.array([overlap != 0 for overlap in path_overlaps], dtype=bool)
+    present_mask = 0
+    for overlap in path_overlaps:
+        present_mask |= overlap
+    module_kos_present = [ko for ko, i in module_net.ko_index.items() if (present_mask >> i) & 1]
+    # count number of missing steps, steps where no path is present
+    missing_steps = module_net.end_steps.size - np.isin(module_net.end_steps, module_net.path_steps[present]).sum()
     # get statistics
-    num_steps = pruned_module_net.graph['num_steps'] + 1
-    num_steps_present = num_steps - missing_steps
+    num_steps = module_net.num_steps + 1
+    num_steps_present = num_steps - int(missing_steps)
     coverage = num_steps_present / num_steps
     return num_steps, num_steps_present, coverage, sorted(module_kos_present)
 
@@ -254,7 +281,7 @@ def make_module_coverage_df(annotation_df, module_nets):
         module_steps, module_steps_present, module_coverage, module_kos = \
             get_module_step_coverage(set(kos_to_genes.keys()), net)
         module_genes = sorted([gene for ko in module_kos for gene in kos_to_genes[ko]])
-        coverage_dict[module] = [net.graph['module_name'], module_steps, module_steps_present, module_coverage,
+        coverage_dict[module] = [net.module_name, module_steps, module_steps_present, module_coverage,
                                  len(module_kos), ','.join(module_kos), ','.join(module_genes)]
     coverage_df = pd.DataFrame.from_dict(coverage_dict, orient='index',
                                          columns=['module_name', 'steps', 'steps_present', 'step_coverage', 'ko_count',
@@ -262,18 +289,22 @@ def make_module_coverage_df(annotation_df, module_nets):
     return coverage_df
 
 
-def make_module_coverage_frame(annotations, module_nets, groupby_column='fasta'):
+def make_module_coverage_frame(annotations, module_nets, groupby_column='fasta', groups=None, threads=1):
+    if groups is None:
+        groups = get_genome_groups(annotations, groupby_column)
     # go through each scaffold to check for modules
-    module_coverage_dict = dict()
-    for group, frame in annotations.groupby(groupby_column, sort=False):
-        module_coverage_dict[group] = make_module_coverage_df(frame, module_nets)
-    module_coverage = pd.concat(module_coverage_dict)
-    module_coverage.index = module_coverage.index.set_names(['genome', 'module'])
+    if threads > 1:
+        with Pool(threads) as pool:
+            coverage_dfs = pool.starmap(make_module_coverage_df,
+                                        [(frame[['kegg_id']], module_nets) for frame in groups.values()])
+    else:
+        coverage_dfs = [make_module_coverage_df(frame, module_nets) for frame in groups.values()]
+    module_coverage = pd.concat(coverage_dfs, keys=list(groups.keys()), names=['genome', 'module'])
     return module_coverage.reset_index()
 
 
 def make_module_coverage_heatmap(module_coverage, mag_order=None):
-    num_mags_in_frame = len(set(module_coverage['genome']))
+    num_mags_in_frame = module_coverage['genome'].nunique()
     c = alt.Chart(module_coverage, title='Module').encode(
         x=alt.X('module_name', title=None, sort=None, axis=alt.Axis(labelLimit=0, labelAngle=90)),
         y=alt.Y('genome', title=None, sort=mag_order, axis=alt.Axis(labelLimit=0)),
@@ -370,7 +401,10 @@ def get_module_coverage(module_net: nx.DiGraph, genes_present: set):
     return max_path_len, len(max_coverage_genes), max_coverage, max_coverage_genes, max_coverage_missing_genes
 
 
-def make_etc_coverage_df(etc_module_df, annotations, groupby_column='fasta'):
+def make_etc_coverage_df(etc_module_df, annotations, groupby_column='fasta', genome_ids=None):
+    if genome_ids is None:
+        genome_ids = get_genome_ids(get_genome_groups(annotations, groupby_column))
+    genome_id_sets = {genome: set(ids) for genome, ids in sorted(genome_ids.items())}
     etc_coverage_df_rows = list()
     for _, module_row in etc_module_df.iterrows():
         definition = module_row['definition']
@@ -382,9 +416,7 @@ def make_etc_coverage_df(etc_module_df, annotations, groupby_column='fasta'):
         for node in no_out:
             module_net.add_edge(node, 'end')
         # go through each genome and check pathway coverage
-        for group, frame in annotations.groupby(groupby_column):
-            # get annotation genes
-            grouped_ids = set(get_ids_from_annotation(frame).keys())
+        for group, grouped_ids in genome_id_sets.items():
             path_len, path_coverage_count, path_coverage_percent, genes, missing_genes = \
                 get_module_coverage(module_net, grouped_ids)
             complex_module_name = 'Complex %s: %s' % (module_row['complex'].replace('Complex ', ''),
@@ -397,7 +429,7 @@ def make_etc_coverage_df(etc_module_df, annotations, groupby_column='fasta'):
 
 
 def make_etc_coverage_heatmap(etc_coverage, mag_order=None, module_order=None):
-    num_mags_in_frame = len(set(etc_coverage['genome']))
+    num_mags_in_frame = etc_coverage['genome'].nunique()
     charts = list()
     for i, (etc_complex, frame) in enumerate(etc_coverage.groupby('complex')):
         # if this is the first chart then make y-ticks otherwise none
@@ -414,41 +446,46 @@ def make_etc_coverage_heatmap(etc_coverage, mag_order=None, module_order=None):
                      ]
         ).mark_rect().encode(color=alt.Color('percent_coverage', legend=alt.Legend(title='% Complete'),
                                              scale=alt.Scale(domain=(0, 1)))).properties(
-            width=HEATMAP_CELL_WIDTH * len(set(frame['module_name'])),
+            width=HEATMAP_CELL_WIDTH * frame['module_name'].nunique(),
             height=HEATMAP_CELL_HEIGHT * num_mags_in_frame)
         charts.append(c)
     concat_title = alt.TitleParams('ETC Complexes', anchor='middle')
     return alt.hconcat(*charts, spacing=5, title=concat_title)
 
 
-def make_functional_df(annotations, function_heatmap_form, groupby_column='fasta'):
+def make_functional_df(annotations, function_heatmap_form, groupby_column='fasta', genome_ids=None):
+    if genome_ids is None:
+        genome_ids = get_genome_ids(get_genome_groups(annotations, groupby_column))
     # clean up function heatmap form
     function_heatmap_form = function_heatmap_form.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
     function_heatmap_form = function_heatmap_form.fillna('')
-    # build dict of ids per genome
-    genome_to_id_dict = dict()
-    for genome, frame in annotations.groupby(groupby_column, sort=False):
-        id_list = get_ids_from_annotation(frame).keys()
-        genome_to_id_dict[genome] = set(id_list)
-    # build long from data frame
-    rows = list()
-    for function, frame in function_heatmap_form.groupby('function_name', sort=False):
-        for bin_name, id_set in genome_to_id_dict.items():
-            presents_in_bin = list()
-            functions_present = set()
-            for _, row in frame.iterrows():
-                function_id_set = set([i.strip() for i in row.function_ids.strip().split(',')])
-                present_in_bin = id_set & function_id_set
-                functions_present = functions_present | present_in_bin
-                presents_in_bin.append(len(present_in_bin) > 0)
-            function_in_bin = np.all(presents_in_bin)
-            row = frame.iloc[0]
-            rows.append([row.category, row.subcategory, row.function_name, ', '.join(functions_present),
-                         '; '.join(get_ordered_uniques(frame.long_function_name)),
-                         '; '.join(get_ordered_uniques(frame.gene_symbol)), bin_name, function_in_bin,
-                         '%s: %s' % (row.category, row.function_name)])
-    return pd.DataFrame(rows, columns=list(function_heatmap_form.columns) + ['genome', 'present',
-                                                                             'category_function_name'])
+    function_heatmap_form = function_heatmap_form.reset_index(drop=True)
+    # long form of ids in each row of the form and of the form ids in each genome
+    form_ids = function_heatmap_form['function_ids'].str.split(',').explode().str.strip()
+    form_ids = pd.DataFrame({'form_row': form_ids.index, 'id': form_ids.to_numpy(),
+                             'function_name': function_heatmap_form['function_name'].to_numpy()[form_ids.index]})
+    form_id_set = set(form_ids['id'])
+    genome_id_long = pd.DataFrame([[genome, id_] for genome, ids in genome_ids.items() for id_ in ids
+                                   if id_ in form_id_set], columns=['genome', 'id'])
+    hits = form_ids.merge(genome_id_long, on='id')
+    # a function is present in a genome if every row of the function has at least one id present
+    rows_present = hits.drop_duplicates(['form_row', 'genome']).groupby(['function_name', 'genome']).size()
+    rows_per_function = function_heatmap_form.groupby('function_name').size()
+    present = rows_present == rows_per_function.reindex(rows_present.index.get_level_values('function_name')).to_numpy()
+    functions_present = hits.drop_duplicates(['function_name', 'genome', 'id']) \
+        .groupby(['function_name', 'genome'])['id'].agg(', '.join)
+    # build long form data frame with a row for every function in every genome
+    function_info = function_heatmap_form.groupby('function_name', sort=False).agg(
+        {'category': 'first', 'subcategory': 'first', 'long_function_name': lambda x: '; '.join(pd.unique(x)),
+         'gene_symbol': lambda x: '; '.join(pd.unique(x))})
+    function_genomes = pd.MultiIndex.from_product([function_info.index, list(genome_ids.keys())],
+                                                  names=['function_name', 'genome'])
+    functional_df = function_genomes.to_frame(index=False).merge(function_info.reset_index(), on='function_name',
+                                                                  how='left')
+    functional_df['function_ids'] = functions_present.reindex(function_genomes, fill_value='').to_numpy()
+    functional_df['present'] = present.reindex(function_genomes, fill_value=False).to_numpy(dtype=bool)
+    functional_df['category_function_name'] = functional_df['category'] + ': ' + functional_df['function_name']
+    return functional_df[list(function_heatmap_form.columns) + ['genome', 'present', 'category_function_name']]
 
 
 def make_functional_heatmap(functional_df, mag_order=None):
@@ -457,7 +494,7 @@ def make_functional_heatmap(functional_df, mag_order=None):
     for i, (group, frame) in enumerate(functional_df.groupby('category', sort=False)):
         # set variables for chart
         function_order = get_ordered_uniques(list(frame.function_name))
-        num_mags_in_frame = len(set(frame['genome']))
+        num_mags_in_frame = frame['genome'].nunique()
         chart_width = HEATMAP_CELL_WIDTH * len(function_order)
         chart_height = HEATMAP_CELL_HEIGHT * num_mags_in_frame
         # if this is the first chart then make y-ticks otherwise none
@@ -493,14 +530,19 @@ def make_functional_heatmap(functional_df, mag_order=None):
 
 
 # TODO: refactor this to handle splitting large numbers of genomes into multiple heatmaps here
-def fill_liquor_dfs(annotations, module_nets, etc_module_df, function_heatmap_form, groupby_column='fasta'):
-    module_coverage_frame = make_module_coverage_frame(annotations, module_nets, groupby_column)
+def fill_liquor_dfs(annotations, module_nets, etc_module_df, function_heatmap_form, groupby_column='fasta',
+                    groups=None, genome_ids=None, threads=1):
+    if groups is None:
+        groups = get_genome_groups(annotations, groupby_column)
+    if genome_ids is None:
+        genome_ids = get_genome_ids(groups, threads)
+    module_coverage_frame = make_module_coverage_frame(annotations, module_nets, groupby_column, groups, threads)
 
     # make ETC frame
-    etc_coverage_df = make_etc_coverage_df(etc_module_df, annotations, groupby_column)
+    etc_coverage_df = make_etc_coverage_df(etc_module_df, annotations, groupby_column, genome_ids)
 
     # make functional frame
-    function_df = make_functional_df(annotations, function_heatmap_form, groupby_column)
+    function_df = make_functional_df(annotations, function_heatmap_form, groupby_column, genome_ids)
 
     return module_coverage_frame, etc_coverage_df, function_df
 
@@ -557,11 +599,16 @@ def make_strings_no_repeats(genome_taxa_dict):
 
 
 def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.', groupby_column='fasta',
-                      custom_distillate=None, distillate_gene_names=False, genomes_per_product=1000):
+                      custom_distillate=None, distillate_gene_names=False, genomes_per_product=1000, threads=1):
     start_time = datetime.now()
 
-    # read in data
-    annotations = pd.read_csv(input_file, sep='\t', index_col=0)
+    # read in data, only keeping the gene names and columns used to summarize
+    annotation_columns = pd.read_csv(input_file, sep='\t', nrows=0).columns
+    usecols = [i for i, column in enumerate(annotation_columns)
+               if i == 0 or column == groupby_column or column in SUMMARY_ANNOTATION_COLUMNS]
+    # genomes are used as group keys throughout so store them as categories
+    annotations = pd.read_csv(input_file, sep='\t', index_col=0, usecols=usecols,
+                              dtype={groupby_column: 'category'})
     if 'bin_taxnomy' in annotations:
         annotations = annotations.sort_values('bin_taxonomy')
 
@@ -569,10 +616,13 @@ def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.'
         trna_frame = None
     else:
         trna_frame = pd.read_csv(trna_path, sep='\t')
+        trna_frame[groupby_column] = trna_frame[groupby_column].astype('category')
     if rrna_path is None:
         rrna_frame = None
     else:
         rrna_frame = pd.read_csv(rrna_path, sep='\t')
+        rrna_frame['fasta'] = rrna_frame['fasta'].astype('category')
+        rrna_frame['type'] = rrna_frame['type'].astype('category')
 
     # get db_locs and read in dbs
     db_locs = get_database_locs()
@@ -596,6 +646,10 @@ def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.'
     # make output folder
     mkdir(output_dir)
 
+    # split annotations by genome once for all summaries
+    groups = get_genome_groups(annotations, groupby_column)
+    genome_ids = get_genome_ids(groups, threads)
+
     # make genome stats
     genome_stats = make_genome_stats(annotations, rrna_frame, trna_frame, groupby_column=groupby_column)
     genome_stats.to_csv(path.join(output_dir, 'genome_stats.tsv'), sep='\t', index=None)
@@ -604,10 +658,11 @@ def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.'
     # make genome metabolism summary
     genome_summary = path.join(output_dir, 'metabolism_summary.xlsx')
     if distillate_gene_names:
-        summarized_genomes = fill_genome_summary_frame_gene_names(annotations, genome_summary_form, groupby_column)
+        summarized_genomes = fill_genome_summary_frame_gene_names(annotations, genome_summary_form, groupby_column,
+                                                                  groups)
     else:
         summarized_genomes = make_genome_summary(annotations, genome_summary_form, trna_frame, rrna_frame,
-                                                 groupby_column)
+                                                 groupby_column, genome_ids)
     write_summarized_genomes_to_xlsx(summarized_genomes, genome_summary)
     print('%s: Generated genome metabolism summary' % (str(datetime.now() - start_time)))
 
@@ -627,8 +682,8 @@ def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.'
         labels = None
 
     # make module coverage frame
-    module_nets = {module: build_module_net(module_df)
-                   for module, module_df in module_steps_form.groupby('module') if module in HEATMAP_MODULES}
+    module_steps_subset = module_steps_form.loc[module_steps_form['module'].isin(HEATMAP_MODULES)]
+    module_nets = {module: build_module_net(module_df) for module, module_df in module_steps_subset.groupby('module')}
 
     if len(genome_order) > genomes_per_product:
         module_coverage_dfs = list()
@@ -638,9 +693,12 @@ def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.'
         pairwise_iter = pairwise(list(range(0, len(genome_order), genomes_per_product)) + [len(genome_order)])
         for i, (start, end) in enumerate(pairwise_iter):
             genomes = genome_order[start:end]
-            annotations_subset = annotations.loc[[genome in genomes for genome in annotations[groupby_column]]]
+            annotations_subset = annotations.loc[annotations[groupby_column].isin(genomes)]
+            groups_subset = {genome: groups[genome] for genome in genomes if genome in groups}
+            genome_ids_subset = {genome: genome_ids[genome] for genome in groups_subset}
             dfs = fill_liquor_dfs(annotations_subset, module_nets, etc_module_df, function_heatmap_form,
-                                  groupby_column='fasta')
+                                  groupby_column=groupby_column, groups=groups_subset,
+                                  genome_ids=genome_ids_subset, threads=threads)
             module_coverage_df_subset, etc_coverage_df_subset, function_df_subset = dfs
             module_coverage_dfs.append(module_coverage_df_subset)
             etc_coverage_dfs.append(etc_coverage_df_subset)
@@ -654,7 +712,10 @@ def summarize_genomes(input_file, trna_path=None, rrna_path=None, output_dir='.'
         module_coverage_df, etc_coverage_df, function_df = fill_liquor_dfs(annotations, module_nets,
                                                                            etc_module_df,
                                                                            function_heatmap_form,
-                                                                           groupby_column=groupby_column)
+                                                                           groupby_column=groupby_column,
+                                                                           groups=groups,
+                                                                           genome_ids=genome_ids,
+                                                                           threads=threads)
         liquor_df = make_liquor_df(module_coverage_df, etc_coverage_df, function_df)
         liquor_df.to_csv(path.join(output_dir, 'product.tsv'), sep='\t')
         liquor = make_liquor_heatmap(module_coverage_df, etc_coverage_df, function_df, genome_order, labels)
@@ -182,7 +182,7 @@ def make_viral_functional_heatmap(functional_df, vgf_order=None):
     for i, (group, frame) in enumerate(functional_df.groupby('Category', sort=False)):
         # set variables for chart
         function_order = get_ordered_uniques(list(frame['Function']))
-        num_vgfs_in_frame = len(set(frame['Contig Name']))
+        num_vgfs_in_frame = frame['Contig Name'].nunique()
         chart_width = HEATMAP_CELL_WIDTH * len(function_order)
         chart_height = HEATMAP_CELL_HEIGHT * num_vgfs_in_frame
         # set up colors for chart
@@ -7,6 +7,12 @@ import json
 from urllib.request import urlopen
 import pandas as pd
 
+KEGG_EC_REGEX = re.compile(r'\[EC:\d*.\d*.\d*.\d*\]')
+CAZY_EC_REGEX = re.compile(r'\(EC \d*.\d*.\d*.\d*\)')
+PFAM_REGEX = re.compile(r'\[PF\d\d\d\d\d.\d*\]')
+# annotation columns that identifiers are pulled from by get_ids_from_annotation and get_ids_from_row
+ID_COLUMNS = ['kegg_id', 'kegg_hit', 'peptidase_family', 'cazy_hits', 'pfam_hits']
+
 
 def get_config_loc():
     return path.abspath(resource_filename('mag_annotator', 'CONFIG'))
@@ -83,7 +89,7 @@ def get_ids_from_annotation(frame):
     # get kegg ec numbers
     if 'kegg_hit' in frame:
         for kegg_hit in frame.kegg_hit.dropna():
-            id_list += [i[1:-1] for i in re.findall(r'\[EC:\d*.\d*.\d*.\d*\]', kegg_hit)]
+            id_list += [i[1:-1] for i in KEGG_EC_REGEX.findall(kegg_hit)]
     # get merops ids
     if 'peptidase_family' in frame:
         id_list += [j.strip() for i in frame.peptidase_family.dropna() for j in i.split(';')]
@@ -92,11 +98,11 @@ def get_ids_from_annotation(frame):
         id_list += [j.split(' ')[0] for i in frame.cazy_hits.dropna() for j in i.split(';')]
         # get cazy ec numbers
         for cazy_hit in frame.cazy_hits.dropna():
-            id_list += [i[1:-1].replace(' ', ':') for i in re.findall(r'\(EC \d*.\d*.\d*.\d*\)', cazy_hit)]
+            id_list += [i[1:-1].replace(' ', ':') for i in CAZY_EC_REGEX.findall(cazy_hit)]
     # get pfam ids
     if 'pfam_hits' in frame:
         id_list += [j[1:-1].split('.')[0] for i in frame.pfam_hits.dropna()
-                    for j in re.findall(r'\[PF\d\d\d\d\d.\d*\]', i)]
+                    for j in PFAM_REGEX.findall(i)]
     return Counter(id_list)
 
 
@@ -108,7 +114,7 @@ def get_ids_from_row(row):
         id_list += [j for j in row['kegg_id'].split(',')]
     # get ec numbers
     if 'kegg_hit' in row and not pd.isna(row['kegg_hit']):
-        id_list += [i[1:-1] for i in re.findall(r'\[EC:\d*.\d*.\d*.\d*\]', row['kegg_hit'])]
+        id_list += [i[1:-1] for i in KEGG_EC_REGEX.findall(row['kegg_hit'])]
     # get merops ids
     if 'peptidase_family' in row and not pd.isna(row['peptidase_family']):
         id_list += [j for j in row['peptidase_family'].split(';')]
@@ -118,7 +124,7 @@ def get_ids_from_row(row):
     # get pfam ids
     if 'pfam_hits' in row and not pd.isna(row['pfam_hits']):
         id_list += [j[1:-1].split('.')[0]
-                    for j in re.findall(r'\[PF\d\d\d\d\d.\d*\]', row['pfam_hits'])]
+                    for j in PFAM_REGEX.findall(row['pfam_hits'])]
     return set(id_list)
 
 
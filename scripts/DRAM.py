@@ -108,6 +108,7 @@ if __name__ == '__main__':
                                                               "value if getting JavaScript Error: Maximum call stack "
                                                               "size exceeded when viewing product.html in browser.",
                                 default=1000, type=int)
+    distill_parser.add_argument('--threads', type=int, default=1, help='number of processors to use')
     distill_parser.set_defaults(func=summarize_genomes)
 
     # parser for getting genes
@@ -21,7 +21,7 @@ setup(
     long_description_content_type='text/markdown',  # Optional (see note above)
     package_data={'mag_annotator': ['CONFIG']},
     python_requires='>=3',
-    install_requires=['scikit-bio', 'pandas', 'altair', 'sqlalchemy', 'networkx', 'openpyxl', 'numpy'],
+    install_requires=['scikit-bio', 'pandas', 'altair', 'sqlalchemy', 'networkx', 'openpyxl', 'xlsxwriter', 'numpy'],
     author="Michael Shaffer",
     author_email='michael.t.shaffer@colostate.edu',
     url="https://github.com/shafferm/DRAM/",
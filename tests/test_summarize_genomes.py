@@ -10,7 +10,7 @@ from mag_annotator.summarize_genomes import get_ordered_uniques, fill_genome_sum
     make_module_coverage_heatmap, pairwise, first_open_paren_is_all, split_into_steps, is_ko, make_module_network, \
     get_module_coverage, make_etc_coverage_df, make_etc_coverage_heatmap, make_functional_df, make_functional_heatmap, \
     fill_liquor_dfs, make_liquor_heatmap, make_liquor_df, make_genome_summary, write_summarized_genomes_to_xlsx,\
-    get_phylum_and_most_specific
+    get_phylum_and_most_specific, make_genome_stats, get_genome_groups, get_genome_ids
 
 
 def test_get_ordered_uniques():
@@ -46,6 +46,12 @@ def test_fill_genome_summary_frame(annotations, genome_summary_frame, summarized
     pd.testing.assert_frame_equal(test_frame, summarized_genomes)
 
 
+def test_get_genome_ids(annotations):
+    groups = get_genome_groups(annotations)
+    assert get_genome_ids(groups) == {'genome': {'K00001': 1}}
+    assert get_genome_ids(groups, threads=2) == {'genome': {'K00001': 1}}
+
+
 def test_summarize_rrnas():
     fake_rrnas = pd.DataFrame([['fake_NC_001422.1', 990, 1000, 101.0, '+', '16S rRNA', pd.np.NaN]],
                               columns=['scaffold', 'begin', 'end', 'e-value', 'strand', 'type', 'note'])
@@ -88,6 +94,28 @@ def test_write_summarized_genomes_to_xlsx(summarized_genomes, tmpdir):
     assert os.path.isfile(output_file)
 
 
+def test_make_genome_stats(fake_processed_trnas):
+    annotations = pd.DataFrame([['Cytophaga_hutchinsonii_ATCC_33406', 'scaffold_1', 'd__Bacteria', 95., 2.],
+                                ['Cytophaga_hutchinsonii_ATCC_33406', 'scaffold_2', 'd__Bacteria', 95., 2.],
+                                ['other_organismii', 'scaffold_1', 'd__Archaea', 60., 1.]],
+                               index=['gene_1', 'gene_2', 'gene_3'],
+                               columns=['fasta', 'scaffold', 'bin_taxonomy', 'bin_completeness', 'bin_contamination'])
+    rrnas = pd.DataFrame([['Cytophaga_hutchinsonii_ATCC_33406', 'scaffold_1', 10, 100, '16S rRNA'],
+                          ['other_organismii', 'scaffold_1', 10, 100, '16S rRNA'],
+                          ['other_organismii', 'scaffold_1', 200, 300, '16S rRNA']],
+                         columns=['fasta', 'scaffold', 'begin', 'end', 'type'])
+    test_genome_stats = make_genome_stats(annotations, rrnas, fake_processed_trnas)
+    genome_stats = pd.DataFrame([['Cytophaga_hutchinsonii_ATCC_33406', 2, 'd__Bacteria', 95., 2., '',
+                                  'scaffold_1 (10, 100)', '', 2, 'med'],
+                                 ['other_organismii', 1, 'd__Archaea', 60., 1., '', '2 present', '', 2, 'med']],
+                                columns=['genome', 'number of scaffolds', 'taxonomy', 'completeness score',
+                                         'contamination score', '5S rRNA', '16S rRNA', '23S rRNA', 'tRNA count',
+                                         'assembly quality'])
+    pd.testing.assert_frame_equal(test_genome_stats, genome_stats)
+    test_genome_stats = make_genome_stats(annotations[['fasta', 'scaffold']])
+    pd.testing.assert_frame_equal(test_genome_stats, genome_stats[['genome', 'number of scaffolds']])
+
+
 @pytest.fixture()
 def test_module_net():
     module_frame = pd.DataFrame([['0,0', 'M12345', 'a module name', 'K00001'],
@@ -99,11 +127,11 @@ def test_module_net():
 
 
 def test_build_module_net(test_module_net):
-    real_module_net = nx.DiGraph(num_steps=0, module_id='M12345', module_name='a module name')
-    real_module_net.add_edges_from([('0,0', 'end_step_0'), ('end_step_0', '1,0'),
-                                    ('1,0', 'end_step_1'), ('end_step_1', '2,0'),
-                                    ('2,0', 'end_step_2')])
-    assert nx.is_isomorphic(test_module_net, real_module_net)
+    assert test_module_net.module_id == 'M12345'
+    assert test_module_net.module_name == 'a module name'
+    assert test_module_net.num_steps == 2
+    assert list(test_module_net.path_steps) == [0, 1, 2]
+    assert test_module_net.path_kos == [{'K00001'}, {'K00002'}, {'K00003'}]
 
 
 def test_get_module_step_coverage(test_module_net):
@@ -143,6 +171,9 @@ def test_make_module_coverage_frame(test_annotations_df, test_module_net, module
     test_module_coverage_frame = make_module_coverage_frame(test_annotations_df, {'M12345': test_module_net},
                                                             groupby_column='scaffold')
     pd.testing.assert_frame_equal(test_module_coverage_frame, module_coverage_frame)
+    test_module_coverage_frame = make_module_coverage_frame(test_annotations_df, {'M12345': test_module_net},
+                                                            groupby_column='scaffold', threads=2)
+    pd.testing.assert_frame_equal(test_module_coverage_frame, module_coverage_frame)
 
 
 def test_make_module_coverage_heatmap(module_coverage_frame):
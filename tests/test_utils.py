@@ -5,7 +5,8 @@ import json
 import pandas as pd
 
 from mag_annotator.utils import run_process, make_mmseqs_db, merge_files, multigrep, get_database_locs, \
-    get_config_loc, remove_prefix, remove_suffix, get_ids_from_row, get_genes_from_identifiers
+    get_config_loc, remove_prefix, remove_suffix, get_ids_from_row, get_genes_from_identifiers, \
+    get_ids_from_annotation
 
 
 def test_run_process():
@@ -118,6 +119,17 @@ def test_get_ids_from_row():
     assert id_set4 == {'GH4', 'GT6'}
 
 
+def test_get_ids_from_annotation():
+    frame = pd.DataFrame([['K00001,K00003', 'Some text and then [EC:0.0.0.0]', 'ABC1;BCD2',
+                           'GH4 some things (EC 3.2.1.4);GT6 other things', 'a domain [PF00001.12]'],
+                          ['K00001', None, None, None, None]],
+                         columns=['kegg_id', 'kegg_hit', 'peptidase_family', 'cazy_hits', 'pfam_hits'])
+    id_counts = get_ids_from_annotation(frame)
+    assert id_counts == {'K00001': 2, 'K00003': 1, 'EC:0.0.0.0': 1, 'ABC1': 1, 'BCD2': 1, 'GH4': 1, 'GT6': 1,
+                         'EC:3.2.1.4': 1, 'PF00001': 1}
+    assert get_ids_from_annotation(frame[['kegg_id']].iloc[[]]) == {}
+
+
 @pytest.fixture()
 def annotations():
     return pd.DataFrame([['bin.1', 'scaffold_1', None],